@@ -1,12 +1,16 @@
-import csv
-import math
-import random
+import os
 from dataclasses import dataclass
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Mapping, Tuple, TypedDict, Union, cast
 
+import numexpr as ne
+import numpy as np
+import pyarrow as pa
+from pyarrow import csv as pacsv
+from pyarrow import parquet as pq
 
-@dataclass
+
+@dataclass(slots=True)
 class SpectralRecord:
     plot_id: str
     row: int
@@ -22,154 +26,295 @@ class SpectralRecord:
     swir_2190: float
 
 
-def _clamp(value: float, lo: float, hi: float) -> float:
-    return max(lo, min(hi, value))
+BAND_COLUMNS = (
+    "blue_480",
+    "green_560",
+    "red_665",
+    "red_edge_705",
+    "red_edge_740",
+    "nir_842",
+    "nir2_865",
+    "swir_1610",
+    "swir_2190",
+)
+CSV_COLUMNS = ("plot_id", "row", "col") + BAND_COLUMNS
+
+# Reflectance is kept to 4 decimals, so 1e-4 steps cover every stored value
+REFLECTANCE_SCALE = 10000
+
+
+class SpectralArrays(TypedDict):
+    """Column-oriented grid: one flat array per CSV column, aligned by plot."""
+
+    plot_id: np.ndarray
+    row: np.ndarray
+    col: np.ndarray
+    blue_480: np.ndarray
+    green_560: np.ndarray
+    red_665: np.ndarray
+    red_edge_705: np.ndarray
+    red_edge_740: np.ndarray
+    nir_842: np.ndarray
+    nir2_865: np.ndarray
+    swir_1610: np.ndarray
+    swir_2190: np.ndarray
+
+
+def _uniform(
+    rng: np.random.Generator, lo: float, hi: float, size: Union[int, Tuple[int, int]]
+) -> np.ndarray:
+    """Draw float32 samples from U[lo, hi); Generator.uniform only produces float64."""
+    return lo + (hi - lo) * rng.random(size, dtype=np.float32)
+
+
+def _evaluate_clipped(
+    expr: str, lo: float, hi: float, out: np.ndarray, **operands: np.ndarray
+) -> None:
+    """Evaluate ``expr`` and clamp it to [lo, hi] in one numexpr pass, writing into ``out``."""
+    ne.evaluate(f"minimum(maximum({expr}, {lo}), {hi})", local_dict=operands, out=out)
+
+
+def _fill_bands(
+    stress: np.ndarray,
+    fertility: np.ndarray,
+    total_reflectance: np.ndarray,
+    noise: Dict[str, np.ndarray],
+    out: Dict[str, np.ndarray],
+) -> None:
+    """Write every band into the preallocated arrays in ``out``.
+
+    ``noise`` holds unit-variance Gaussian draws per channel ("ndvi" plus each band);
+    the per-channel sigmas live here with the rest of the band equations. Each band is
+    a single fused numexpr expression, so no full-grid temporaries are materialized.
+    """
+    ndvi = np.empty_like(stress)
+    _evaluate_clipped(
+        "0.70 + fertility - 0.40 * stress + 0.02 * eps",
+        0.05,
+        0.92,
+        ndvi,
+        fertility=fertility,
+        stress=stress,
+        eps=noise["ndvi"],
+    )
+
+    # Split total reflectance into NIR and red so that (nir - red) / (nir + red) == ndvi
+    _evaluate_clipped(
+        "(ndvi + 1.0) * total / 2.0 + 0.006 * eps",
+        0.01,
+        0.95,
+        out["nir_842"],
+        ndvi=ndvi,
+        total=total_reflectance,
+        eps=noise["nir_842"],
+    )
+    _evaluate_clipped(
+        "(1.0 - ndvi) * total / 2.0 + 0.006 * eps",
+        0.01,
+        0.95,
+        out["red_665"],
+        ndvi=ndvi,
+        total=total_reflectance,
+        eps=noise["red_665"],
+    )
+
+    _evaluate_clipped(
+        "0.04 + 0.07 * (1.1 - ndvi) + 0.006 * eps",
+        0.02,
+        0.22,
+        out["blue_480"],
+        ndvi=ndvi,
+        eps=noise["blue_480"],
+    )
+    _evaluate_clipped(
+        "0.20 + 0.12 * (0.9 - stress) + 0.01 * eps",
+        0.12,
+        0.42,
+        out["green_560"],
+        stress=stress,
+        eps=noise["green_560"],
+    )
+    _evaluate_clipped(
+        "0.18 + 0.40 * ndvi + 0.008 * eps",
+        0.10,
+        0.70,
+        out["red_edge_705"],
+        ndvi=ndvi,
+        eps=noise["red_edge_705"],
+    )
+    _evaluate_clipped(
+        "red_edge + 0.05 * (ndvi - 0.5) + 0.006 * eps",
+        0.10,
+        0.75,
+        out["red_edge_740"],
+        red_edge=out["red_edge_705"],
+        ndvi=ndvi,
+        eps=noise["red_edge_740"],
+    )
+    _evaluate_clipped(
+        "nir + 0.004 * eps + 0.02 * (1.0 - stress)",
+        0.05,
+        0.95,
+        out["nir2_865"],
+        nir=out["nir_842"],
+        stress=stress,
+        eps=noise["nir2_865"],
+    )
+
+    _evaluate_clipped(
+        "0.22 + 0.28 * stress + 0.01 * eps",
+        0.10,
+        0.70,
+        out["swir_1610"],
+        stress=stress,
+        eps=noise["swir_1610"],
+    )
+    _evaluate_clipped(
+        "swir1 + 0.05 * stress + 0.01 * eps",
+        0.10,
+        0.75,
+        out["swir_2190"],
+        swir1=out["swir_1610"],
+        stress=stress,
+        eps=noise["swir_2190"],
+    )
 
 
 def generate_spectral_grid(
     rows: int = 140, cols: int = 140, seed: int = 1337
-) -> List[SpectralRecord]:
+) -> SpectralArrays:
     """Create a reproducible grid of multispectral reflectance approximating field data."""
 
-    rng = random.Random(seed)
+    rng = np.random.default_rng(seed)
+    shape = (rows, cols)
+    r_idx, c_idx = np.indices(shape, dtype=np.int32)
 
     # Two stress pockets plus a mild northwest-southeast fertility gradient
     stress_centers = [
         (rows * 0.65, cols * 0.68, (rows * 0.20) ** 2),
         (rows * 0.30, cols * 0.25, (rows * 0.18) ** 2),
     ]
+    # Geometry only varies along one axis at a time, so build 1-D tables and broadcast.
+    # Each Gaussian pocket separates into a row factor times a column factor.
+    r_axis = np.arange(rows, dtype=np.float32)
+    c_axis = np.arange(cols, dtype=np.float32)
+    stress = np.zeros(shape, dtype=np.float32)
+    for cr, cc, sigma2 in stress_centers:
+        # sigma2 is 0 for an empty grid; the other axis's falloff is then discarded unused
+        with np.errstate(divide="ignore", invalid="ignore"):
+            row_falloff = np.exp(-((r_axis - cr) ** 2) / (2 * sigma2))
+            col_falloff = np.exp(-((c_axis - cc) ** 2) / (2 * sigma2))
+        stress += row_falloff[:, None] * col_falloff[None, :]
+    np.clip(stress, 0.0, 1.6, out=stress)
+
+    fertility = 0.15 * (1 - r_axis / rows)[:, None] + 0.05 * (c_axis / cols)[None, :]
 
     # Column banding noise (e.g., sensor striping) and row-based illumination gradient
-    col_bias = [rng.gauss(1.0, 0.01) for _ in range(cols)]
-    row_gradient = [1.0 + 0.04 * math.sin(r / 11.0) for r in range(rows)]
-
-    records: List[SpectralRecord] = []
-    for r in range(rows):
-        for c in range(cols):
-            stress = 0.0
-            for cr, cc, sigma2 in stress_centers:
-                dist2 = (r - cr) ** 2 + (c - cc) ** 2
-                stress += math.exp(-dist2 / (2 * sigma2))
-            stress = _clamp(stress, 0.0, 1.6)
-
-            fertility = 0.15 * (1 - r / rows) + 0.05 * (c / cols)
-            illumination = rng.uniform(0.93, 1.07) * row_gradient[r] * col_bias[c]
-
-            target_ndvi = 0.70 + fertility - 0.40 * stress + rng.gauss(0.0, 0.02)
-            target_ndvi = _clamp(target_ndvi, 0.05, 0.92)
-
-            total_reflectance = illumination * rng.uniform(0.42, 0.80)
-            nir = (target_ndvi + 1.0) * total_reflectance / 2.0
-            red = total_reflectance - nir
-
-            nir += rng.gauss(0.0, 0.006)
-            red += rng.gauss(0.0, 0.006)
-
-            nir = _clamp(nir, 0.01, 0.95)
-            red = _clamp(red, 0.01, 0.95)
-
-            blue = _clamp(0.04 + 0.07 * (1.1 - target_ndvi) + rng.gauss(0.0, 0.006), 0.02, 0.22)
-            green = _clamp(0.20 + 0.12 * (0.9 - stress) + rng.gauss(0.0, 0.01), 0.12, 0.42)
-            red_edge = _clamp(0.18 + 0.40 * target_ndvi + rng.gauss(0.0, 0.008), 0.10, 0.70)
-            red_edge2 = _clamp(red_edge + 0.05 * (target_ndvi - 0.5) + rng.gauss(0.0, 0.006), 0.10, 0.75)
-            nir2 = _clamp(nir + rng.gauss(0.0, 0.004) + 0.02 * (1.0 - stress), 0.05, 0.95)
-
-            swir1 = _clamp(0.22 + 0.28 * stress + rng.gauss(0.0, 0.01), 0.10, 0.70)
-            swir2 = _clamp(swir1 + 0.05 * stress + rng.gauss(0.0, 0.01), 0.10, 0.75)
-
-            # Occasional thin-cloud effect: brighten visible, mute NIR
-            if rng.random() < 0.02:
-                factor_vis = rng.uniform(1.05, 1.12)
-                factor_nir = rng.uniform(0.90, 0.96)
-                blue *= factor_vis
-                green *= factor_vis
-                red *= factor_vis
-                red_edge *= factor_vis
-                red_edge2 *= factor_vis
-                nir *= factor_nir
-                nir2 *= factor_nir
-                swir1 *= factor_vis * 0.9
-                swir2 *= factor_vis * 0.9
-
-            plot_id = f"R{r + 1:03d}C{c + 1:03d}"
-            records.append(
-                SpectralRecord(
-                    plot_id,
-                    r,
-                    c,
-                    blue,
-                    green,
-                    red,
-                    red_edge,
-                    red_edge2,
-                    nir,
-                    nir2,
-                    swir1,
-                    swir2,
-                )
-            )
-
-    return records
-
-
-def save_records_csv(records: List[SpectralRecord], path: Path) -> None:
+    col_bias = 1.0 + 0.01 * rng.standard_normal(cols, dtype=np.float32)
+    row_gradient = 1.0 + 0.04 * np.sin(r_axis / 11.0)
+    illumination = _uniform(rng, 0.93, 1.07, shape) * row_gradient[:, None] * col_bias[None, :]
+
+    total_reflectance = illumination * _uniform(rng, 0.42, 0.80, shape)
+    # One batched draw covers every noise channel; each entry is a view into the block
+    channels = ("ndvi",) + BAND_COLUMNS
+    noise: Dict[str, np.ndarray] = dict(
+        zip(channels, rng.standard_normal((len(channels),) + shape, dtype=np.float32))
+    )
+    bands: Dict[str, np.ndarray] = {
+        name: np.empty(shape, dtype=np.float32) for name in BAND_COLUMNS
+    }
+    _fill_bands(stress, fertility, total_reflectance, noise, bands)
+
+    # Occasional thin-cloud effect: brighten visible, mute NIR
+    # Clear pixels get a factor of 1.0, so every band is scaled uniformly with no masked gather
+    cloud = rng.random(shape, dtype=np.float32) < 0.02
+    factor_vis = np.where(cloud, _uniform(rng, 1.05, 1.12, shape), 1.0)
+    factor_nir = np.where(cloud, _uniform(rng, 0.90, 0.96, shape), 1.0)
+    factor_swir = np.where(cloud, factor_vis * 0.9, 1.0)
+    for name in ("blue_480", "green_560", "red_665", "red_edge_705", "red_edge_740"):
+        bands[name] *= factor_vis
+    for name in ("nir_842", "nir2_865"):
+        bands[name] *= factor_nir
+    for name in ("swir_1610", "swir_2190"):
+        bands[name] *= factor_swir
+
+    # Format the 1-based labels once per axis and let broadcasting build every "RrrrCccc" id
+    row_labels = np.array([f"R{r:03d}" for r in range(1, rows + 1)], dtype=str)
+    col_labels = np.array([f"C{c:03d}" for c in range(1, cols + 1)], dtype=str)
+    plot_ids = np.char.add(row_labels[:, None], col_labels[None, :]).ravel()
+    columns = {"plot_id": plot_ids, "row": r_idx.ravel(), "col": c_idx.ravel()}
+    columns.update((name, band.ravel()) for name, band in bands.items())
+    return cast(SpectralArrays, columns)
+
+
+def _columns(arrays: SpectralArrays) -> Mapping[str, np.ndarray]:
+    """View the grid as a plain name -> array mapping, for loops over dynamic column names."""
+    return cast(Mapping[str, np.ndarray], arrays)
+
+
+def records_from_arrays(arrays: SpectralArrays) -> List[SpectralRecord]:
+    """Materialize per-plot records for callers that still expect the row-oriented API."""
+    columns = [_columns(arrays)[name].tolist() for name in CSV_COLUMNS]
+    return [SpectralRecord(*fields) for fields in zip(*columns)]
+
+
+def save_records_csv(arrays: SpectralArrays, path: Path) -> None:
     path.parent.mkdir(parents=True, exist_ok=True)
+    # One %-format per row over plain Python values, then a single write of the whole file
+    row_format = "%s,%d,%d" + ",%.4f" * len(BAND_COLUMNS)
+    columns = [_columns(arrays)[name].tolist() for name in CSV_COLUMNS]
+    lines = [",".join(CSV_COLUMNS)]
+    lines.extend(row_format % fields for fields in zip(*columns))
     with path.open("w", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow(
-            [
-                "plot_id",
-                "row",
-                "col",
-                "blue_480",
-                "green_560",
-                "red_665",
-                "red_edge_705",
-                "red_edge_740",
-                "nir_842",
-                "nir2_865",
-                "swir_1610",
-                "swir_2190",
-            ]
-        )
-        for rec in records:
-            writer.writerow(
-                [
-                    rec.plot_id,
-                    rec.row,
-                    rec.col,
-                    f"{rec.blue_480:.4f}",
-                    f"{rec.green_560:.4f}",
-                    f"{rec.red_665:.4f}",
-                    f"{rec.red_edge_705:.4f}",
-                    f"{rec.red_edge_740:.4f}",
-                    f"{rec.nir_842:.4f}",
-                    f"{rec.nir2_865:.4f}",
-                    f"{rec.swir_1610:.4f}",
-                    f"{rec.swir_2190:.4f}",
-                ]
-            )
-
-
-def load_records_csv(path: Path) -> List[SpectralRecord]:
-    records: List[SpectralRecord] = []
-    with path.open() as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            records.append(
-                SpectralRecord(
-                    plot_id=row["plot_id"],
-                    row=int(row["row"]),
-                    col=int(row["col"]),
-                    blue_480=float(row["blue_480"]),
-                    green_560=float(row["green_560"]),
-                    red_665=float(row["red_665"]),
-                    red_edge_705=float(row["red_edge_705"]),
-                    red_edge_740=float(row["red_edge_740"]),
-                    nir_842=float(row["nir_842"]),
-                    nir2_865=float(row["nir2_865"]),
-                    swir_1610=float(row["swir_1610"]),
-                    swir_2190=float(row["swir_2190"]),
-                )
-            )
-    return records
+        f.write("\n".join(lines) + "\n")
+
+
+def _arrays_from_table(table: pa.Table) -> SpectralArrays:
+    # Table.column raises KeyError for files written with an older schema
+    return cast(SpectralArrays, {name: table.column(name).to_numpy() for name in CSV_COLUMNS})
+
+
+def load_records_csv(path: Path) -> SpectralArrays:
+    column_types = {"plot_id": pa.string(), "row": pa.int32(), "col": pa.int32()}
+    column_types.update((name, pa.float32()) for name in BAND_COLUMNS)
+    table = pacsv.read_csv(path, convert_options=pacsv.ConvertOptions(column_types=column_types))
+    return _arrays_from_table(table)
+
+
+def quantize_reflectance(band: np.ndarray) -> np.ndarray:
+    """Store a reflectance band as uint16 counts of 1e-4, exact for 4-decimal values."""
+    return np.clip(np.rint(band * REFLECTANCE_SCALE), 0, np.iinfo(np.uint16).max).astype(np.uint16)
+
+
+def dequantize_reflectance(counts: np.ndarray) -> np.ndarray:
+    # Dividing (rather than multiplying by 1e-4) yields the same float32 as parsing the CSV text
+    return counts.astype(np.float32) / np.float32(REFLECTANCE_SCALE)
+
+
+def save_records_parquet(arrays: SpectralArrays, path: Path) -> None:
+    """Persist the arrays as a columnar Parquet file that loads without any text parsing.
+
+    Bands are quantized to uint16 (see quantize_reflectance), so the decoded columns are half
+    the size of float32 before they are scaled back.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    columns = dict(_columns(arrays))
+    columns.update((name, quantize_reflectance(columns[name])) for name in BAND_COLUMNS)
+    # Write beside the target and swap it in, so an interrupted write never leaves a
+    # truncated cache at the final path
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        pq.write_table(pa.table(columns), tmp_path, compression="snappy")
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+def load_records_parquet(path: Path) -> SpectralArrays:
+    columns = dict(_columns(_arrays_from_table(pq.read_table(path))))
+    for name in BAND_COLUMNS:
+        # Caches written before bands were quantized already hold float32 reflectance
+        if np.issubdtype(columns[name].dtype, np.integer):
+            columns[name] = dequantize_reflectance(columns[name])
+    return cast(SpectralArrays, columns)
@@ -1,10 +1,18 @@
-import math
 from pathlib import Path
-from typing import Iterable, List, Sequence, Tuple
+from typing import Optional, Tuple
 
-import matplotlib.pyplot as plt
+import numexpr as ne
+import numpy as np
+import pyarrow as pa
 
-from data_gen import SpectralRecord, generate_spectral_grid, load_records_csv, save_records_csv
+from data_gen import (
+    SpectralArrays,
+    generate_spectral_grid,
+    load_records_csv,
+    load_records_parquet,
+    save_records_csv,
+    save_records_parquet,
+)
 
 
 def ndvi(red: float, nir: float) -> float:
@@ -15,85 +23,116 @@ def ndvi(red: float, nir: float) -> float:
     return (nir - red) / denom
 
 
-NDVIResult = Tuple[int, int, str, float]
+# (row, col, plot_id, ndvi) arrays, aligned by plot
+NDVIResult = Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
 
 
-def run_example(
-    records: Sequence[SpectralRecord], preview_count: int = 80
-) -> List[NDVIResult]:
-    """Process records, print preview, and return NDVI per plot."""
-    results: List[NDVIResult] = []
-    for rec in records:
-        value = ndvi(rec.red_665, rec.nir_842)
-        results.append((rec.row, rec.col, rec.plot_id, value))
+def run_example(arrays: SpectralArrays, preview_count: int = 80) -> NDVIResult:
+    """Process the grid arrays, print preview, and return NDVI per plot."""
+    red = arrays["red_665"]
+    nir = arrays["nir_842"]
+    # One fused, multithreaded pass; zero denominators map to NaN like ndvi() does
+    values = ne.evaluate(
+        "where(nir + red == 0, nan, (nir - red) / (nir + red))",
+        local_dict={"nir": nir, "red": red, "nan": np.float32(np.nan)},
+    )
+    results: NDVIResult = (arrays["row"], arrays["col"], arrays["plot_id"], values)
 
-    valid = [v for _, _, _, v in results if math.isfinite(v)]
-    mean_ndvi = sum(valid) / len(valid) if valid else float("nan")
-    lo = min(valid) if valid else float("nan")
-    hi = max(valid) if valid else float("nan")
+    # One finiteness pass, then plain reductions over the compacted values
+    valid = values[np.isfinite(values)]
+    if valid.size:
+        mean_ndvi, lo, hi = float(valid.mean()), float(valid.min()), float(valid.max())
+    else:
+        mean_ndvi = lo = hi = float("nan")
 
-    shown = min(preview_count, len(results))
-    print(f"Plot  NDVI (showing {shown}/{len(results)})")
-    for idx, (r, c, plot_id, value) in enumerate(results):
-        if idx >= preview_count:
-            break
-        print(f"{plot_id:>7}  r={r + 1:03d} c={c + 1:03d}  {value:6.3f}")
-    if shown < len(results):
-        print(f"... {len(results) - shown} more plots not shown")
+    shown = min(preview_count, values.size)
+    lines = [f"Plot  NDVI (showing {shown}/{values.size})"]
+    lines.extend(
+        f"{plot_id:>7}  r={r + 1:03d} c={c + 1:03d}  {value:6.3f}"
+        for r, c, plot_id, value in zip(*(arr[:shown].tolist() for arr in results))
+    )
+    if shown < values.size:
+        lines.append(f"... {values.size - shown} more plots not shown")
 
-    print("\nField summary:")
-    print(f"mean={mean_ndvi:.3f}  min={lo:.3f}  max={hi:.3f}")
+    lines.append("\nField summary:")
+    lines.append(f"mean={mean_ndvi:.3f}  min={lo:.3f}  max={hi:.3f}")
 
-    stressed = [plot_id for _, _, plot_id, value in results if value < 0.30]
+    stressed = arrays["plot_id"][np.flatnonzero(values < 0.30)].tolist()
     if stressed:
-        print("Potentially stressed plots: " + ", ".join(stressed))
+        lines.append("Potentially stressed plots: " + ", ".join(stressed))
     else:
-        print("No plots under the 0.30 stress threshold.")
+        lines.append("No plots under the 0.30 stress threshold.")
+
+    # Emit the whole report in one write rather than one print per line
+    print("\n".join(lines))
 
     return results
 
 
 def visualize_ndvi(
-    results: Sequence[NDVIResult], rows: int, cols: int, outfile: str = "ndvi_heatmap.png"
+    results: NDVIResult, rows: int, cols: int, outfile: Optional[str] = "ndvi_heatmap.png"
 ) -> None:
-    """Render a heatmap for NDVI and write it to disk."""
-
-    grid = [[float("nan") for _ in range(cols)] for _ in range(rows)]
-    for r, c, _, value in results:
-        if 0 <= r < rows and 0 <= c < cols:
-            grid[r][c] = value
-
-    plt.figure(figsize=(9, 7))
-    img = plt.imshow(grid, cmap="YlGn", vmin=0.0, vmax=0.9, origin="lower")
-    plt.colorbar(img, label="NDVI")
-    plt.title("Synthetic Field NDVI (heatmap)")
-    plt.xlabel("Column index (0-based)")
-    plt.ylabel("Row index (0-based)")
-    plt.tight_layout()
-    plt.savefig(outfile, dpi=200)
-    plt.close()
+    """Render a heatmap for NDVI and write it to disk; do nothing when outfile is None."""
+    if outfile is None:
+        return
+
+    # Deferred so runs that skip the heatmap never pay for importing matplotlib. Rendering
+    # through a bare Figure on an Agg canvas avoids pyplot, so no GUI backend is probed and
+    # the process-wide backend of an interactive session is left alone.
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    grid = np.full((rows, cols), np.nan, dtype=np.float32)
+    row_idx, col_idx, _, values = results
+    inside = (row_idx >= 0) & (row_idx < rows) & (col_idx >= 0) & (col_idx < cols)
+    grid[row_idx[inside], col_idx[inside]] = values[inside]
+
+    fig = Figure(figsize=(9, 7))
+    FigureCanvasAgg(fig)
+    ax = fig.subplots()
+    img = ax.imshow(grid, cmap="YlGn", vmin=0.0, vmax=0.9, origin="lower")
+    fig.colorbar(img, ax=ax, label="NDVI")
+    ax.set_title("Synthetic Field NDVI (heatmap)")
+    ax.set_xlabel("Column index (0-based)")
+    ax.set_ylabel("Row index (0-based)")
+    fig.tight_layout()
+    fig.savefig(outfile, dpi=200)
 
 
 def main() -> None:
     data_path = Path("data/synthetic_field_multispec.csv")
+    cache_path = data_path.with_suffix(".parquet")
+    rows, cols = 140, 140
 
     def regenerate() -> None:
-        records_new = generate_spectral_grid(rows=140, cols=140, seed=114514)
-        save_records_csv(records_new, data_path)
+        arrays_new = generate_spectral_grid(rows=rows, cols=cols, seed=114514)
+        save_records_csv(arrays_new, data_path)
         print(f"Generated synthetic dataset at {data_path}")
 
-    if not data_path.exists():
-        regenerate()
+    def load() -> SpectralArrays:
+        # The CSV stays the human-readable source; the Parquet copy next to it skips text
+        # parsing on later runs and is rebuilt whenever the CSV is newer than it.
+        if cache_path.exists() and cache_path.stat().st_mtime >= data_path.stat().st_mtime:
+            try:
+                return load_records_parquet(cache_path)
+            except (pa.ArrowInvalid, OSError, KeyError):
+                pass  # Damaged or outdated cache: fall through and rebuild it from the CSV
+        arrays_csv = load_records_csv(data_path)
+        save_records_parquet(arrays_csv, cache_path)
+        return arrays_csv
 
     try:
-        records = load_records_csv(data_path)
-    except KeyError:
+        arrays = load()
+    except (FileNotFoundError, KeyError):
+        # Reload what was written so the first run reports the same rounded values as later
+        # runs. A fresh grid is dense with the dimensions above, so it needs no row/col scan.
         regenerate()
-        records = load_records_csv(data_path)
-    rows = max(rec.row for rec in records) + 1
-    cols = max(rec.col for rec in records) + 1
+        arrays = load()
+    else:
+        rows = int(arrays["row"].max()) + 1
+        cols = int(arrays["col"].max()) + 1
 
-    results = run_example(records, preview_count=80)
+    results = run_example(arrays, preview_count=80)
     visualize_ndvi(results, rows, cols, outfile="ndvi_heatmap.png")
 
 